@@ -1,6 +1,35 @@
 import itertools
+import logging
 import random
 
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Shared result for sentences that determine no cells
+_NO_CELLS = frozenset()
+
+# Offsets of the eight cells surrounding a cell
+_NEIGHBORS = tuple(
+    (di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if di or dj
+)
+
+
+def _bit(cell, width):
+    """
+    Returns the single-bit mask representing a cell
+    on a board of the given width.
+    """
+    return 1 << (cell[0] * width + cell[1])
+
+
+def _count_mines_in_region(board, r0, r1, c0, c1):
+    """
+    Returns the number of mines in rows r0..r1-1
+    and columns c0..c1-1 of the board.
+    """
+    return sum(sum(row[c0:c1]) for row in board[r0:r1])
+
 
 class Minesweeper():
     """
@@ -22,13 +51,11 @@ class Minesweeper():
                 row.append(False)
             self.board.append(row)
 
-        # Add mines randomly
-        while len(self.mines) != mines:
-            i = random.randrange(height)
-            j = random.randrange(width)
-            if not self.board[i][j]:
-                self.mines.add((i, j))
-                self.board[i][j] = True
+        # Add mines randomly, drawing distinct cells without rejection
+        for k in random.sample(range(self.height * self.width), mines):
+            i, j = divmod(k, self.width)
+            self.mines.add((i, j))
+            self.board[i][j] = True
 
         # At first, player has found no mines
         self.mines_found = set()
@@ -59,23 +86,16 @@ class Minesweeper():
         not including the cell itself.
         """
 
-        # Keep count of nearby mines
-        count = 0
-
-        # Loop over all cells within one row and column
-        for i in range(cell[0] - 1, cell[0] + 2):
-            for j in range(cell[1] - 1, cell[1] + 2):
-
-                # Ignore the cell itself
-                if (i, j) == cell:
-                    continue
-
-                # Update count if cell in bounds and is mine
-                if 0 <= i < self.height and 0 <= j < self.width:
-                    if self.board[i][j]:
-                        count += 1
+        i, j = cell
 
-        return count
+        # Count the 3x3 block around the cell, clipped to the board,
+        # then discount the cell itself
+        count = _count_mines_in_region(
+            self.board,
+            max(0, i - 1), min(self.height, i + 2),
+            max(0, j - 1), min(self.width, j + 2)
+        )
+        return count - self.board[i][j]
 
     def won(self):
         """
@@ -89,36 +109,60 @@ class Sentence():
     Logical statement about a Minesweeper game
     A sentence consists of a set of board cells,
     and a count of the number of those cells which are mines.
+    When the board width is given, the cells are also mirrored in
+    `mask`, one bit per cell, so that subset tests are integer operations.
+    Without a width, `mask` is None.
     """
 
-    def __init__(self, cells, count):
+    def __init__(self, cells, count, width=None):
         self.cells = set(cells)
         self.count = count
+        self.width = width
+
+        self.mask = None
+        if width is not None:
+            self.mask = 0
+            for cell in self.cells:
+                self.mask |= _bit(cell, width)
+
+        # Hash of (cells, count), computed on demand and cleared by mark_*
+        self._hash = None
 
     def __eq__(self, other):
         return self.cells == other.cells and self.count == other.count
 
+    def __hash__(self):
+        # Marking a cell changes the hash, so a sentence must not be kept
+        # in a set or dict key across calls to mark_mine or mark_safe
+        if self._hash is None:
+            self._hash = hash((frozenset(self.cells), self.count))
+        return self._hash
+
     def __str__(self):
         return f"{self.cells} = {self.count}"
 
     def known_mines(self):
         """
         Returns the set of all cells in self.cells known to be mines.
+        The result is the sentence's own cells, or a shared empty set,
+        and must not be modified.
         """
         # raise NotImplementedError
         if len(self.cells) == self.count and self.count > 0:
-            print("Found mine(s) : ", self.cells)
+            logger.debug("Found mine(s) : %s", self.cells)
             return self.cells
-        return set()
+        return _NO_CELLS
 
     def known_safes(self):
         """
         Returns the set of all cells in self.cells known to be safe.
+        The result is the sentence's own cells, or a shared empty set,
+        and must not be modified.
         """
         # raise NotImplementedError
         if self.count == 0:
             return self.cells
-        return set()
+        return _NO_CELLS
 
     def mark_mine(self, cell):
         """
@@ -129,6 +173,9 @@ class Sentence():
         if cell in self.cells:
             self.cells.remove(cell)
             self.count = self.count - 1
+            self._hash = None
+            if self.mask is not None:
+                self.mask &= ~_bit(cell, self.width)
 
     def mark_safe(self, cell):
         """
@@ -138,6 +185,9 @@ class Sentence():
         # raise NotImplementedError
         if cell in self.cells:
             self.cells.remove(cell)
+            self._hash = None
+            if self.mask is not None:
+                self.mask &= ~_bit(cell, self.width)
 
 
 class MinesweeperAI():
@@ -158,27 +208,189 @@ class MinesweeperAI():
         self.mines = set()
         self.safes = set()
 
+        # Every cell on the board
+        self._all_cells = frozenset(
+            (i, j) for i in range(height) for j in range(width)
+        )
+
+        # Cells known to be safe that have not been clicked on yet, and the
+        # sizes of self.safes and self.moves_made it was last brought up to
+        self._available_safes = set()
+        self._safes_seen = 0
+        self._moves_seen = 0
+
         # List of sentences about the game known to be true
         self.knowledge = []
 
+        # Index of the cell mask of every live sentence in the KB
+        self._kb_index = {}
+
+        # Sentences containing each undetermined cell
+        self._cell_to_sentences = {}
+
+        # Number of live sentences with a positive count holding each cell
+        self._dangerous = {}
+
+        # Live sentences that are new or have changed since they were last
+        # compared with their neighbours, keyed by cell mask
+        self._dirty = {}
+
+        # Sentences whose cells are all safe or all mines, to be
+        # propagated before any subset inference
+        self._units = deque()
+
     def mark_mine(self, cell):
         """
         Marks a cell as a mine, and updates all knowledge
         to mark that cell as a mine as well.
         """
-        self.mines.add(cell)
-        for sentence in self.knowledge:
-            sentence.mark_mine(cell)
+        self._sync_knowledge()
+        self._mark_mine(cell)
 
     def mark_safe(self, cell):
         """
         Marks a cell as safe, and updates all knowledge
         to mark that cell as safe as well.
         """
-        self.safes.add(cell)
-        for sentence in self.knowledge:
+        self._sync_knowledge()
+        self._mark_safe(cell)
+
+    def _mark_mine(self, cell):
+        """
+        Marks a cell as a mine, updating the sentences indexed under it.
+        """
+        self.mines.add(cell)
+        for sentence in self._cell_to_sentences.pop(cell, ()):
+            self._update_sentence(sentence, sentence.mark_mine, cell)
+
+    def _mark_safe(self, cell):
+        """
+        Marks a cell as safe, updating the sentences indexed under it.
+        """
+        if cell not in self.safes:
+            self.safes.add(cell)
+            self._safes_seen += 1
+            if cell not in self.moves_made:
+                self._available_safes.add(cell)
+        for sentence in self._cell_to_sentences.pop(cell, ()):
+            self._update_sentence(sentence, sentence.mark_safe, cell)
+
+    def _update_sentence(self, sentence, mark, cell):
+        """
+        Applies `mark` to a sentence containing `cell`, keeping the index
+        in step and queueing the sentence to be examined again.
+        A sentence that empties or duplicates another one is retired:
+        it takes no further part in inference and is dropped from
+        self.knowledge once inference settles.
+        """
+        live = self._kb_index.get(sentence.mask) is sentence
+        if live:
+            del self._kb_index[sentence.mask]
+            self._dirty.pop(sentence.mask, None)
+            self._track(sentence, -1)
+        mark(cell)
+        if live and sentence.cells and sentence.mask not in self._kb_index:
+            self._kb_index[sentence.mask] = sentence
+            self._track(sentence, 1)
+            self._queue(sentence)
+
+    def _track(self, sentence, delta):
+        """
+        Adds `delta` to the dangerous-cell counts of a sentence's cells,
+        if the sentence still claims at least one mine.
+        """
+        if sentence.count > 0:
+            for cell in sentence.cells:
+                n = self._dangerous.get(cell, 0) + delta
+                if n:
+                    self._dangerous[cell] = n
+                else:
+                    del self._dangerous[cell]
+
+    def _queue(self, sentence):
+        """
+        Queues a live sentence to be examined by _propagate.
+        """
+        if sentence.count == 0 or sentence.count == len(sentence.cells):
+            self._units.append(sentence)
+        else:
+            self._dirty[sentence.mask] = sentence
+
+    def _index(self, sentence):
+        """
+        Indexes a sentence of self.knowledge and queues it to be examined.
+        """
+        self._kb_index[sentence.mask] = sentence
+        for cell in sentence.cells:
+            self._cell_to_sentences.setdefault(cell, []).append(sentence)
+        self._track(sentence, 1)
+        self._queue(sentence)
+
+    def _forget(self, sentence):
+        """
+        Removes a live sentence that is no longer in self.knowledge
+        from the indexes.
+        """
+        del self._kb_index[sentence.mask]
+        self._dirty.pop(sentence.mask, None)
+        self._track(sentence, -1)
+        for cell in sentence.cells:
+            sentences = self._cell_to_sentences[cell]
+            sentences[:] = [other for other in sentences if other is not sentence]
+            if not sentences:
+                del self._cell_to_sentences[cell]
+
+    def _add_sentence(self, sentence):
+        """
+        Adds a sentence to the knowledge base, unless a sentence
+        about the same cells is already known. The sentence must use
+        this board's width and only mention undetermined cells.
+        Returns True if the sentence was added.
+        """
+        if not sentence.cells or sentence.mask in self._kb_index:
+            return False
+        self.knowledge.append(sentence)
+        self._index(sentence)
+        return True
+
+    def _adopt(self, sentence):
+        """
+        Updates a sentence that was put into self.knowledge directly
+        in place: gives it a mask for this board and removes the cells
+        already known to be safe or mines.
+        """
+        sentence.width = self.width
+        sentence.mask = 0
+        for cell in sentence.cells:
+            sentence.mask |= _bit(cell, self.width)
+        for cell in sentence.cells & self.mines:
+            sentence.mark_mine(cell)
+        for cell in sentence.cells & self.safes:
             sentence.mark_safe(cell)
 
+    def _sync_knowledge(self):
+        """
+        Brings the indexes in line with self.knowledge, which may have
+        been changed directly. Indexed sentences no longer in the list are
+        forgotten, and listed sentences that are not indexed are adopted
+        and indexed. Sentences that are empty, or duplicate another one,
+        are dropped from the list.
+        """
+        listed = {id(sentence) for sentence in self.knowledge}
+        for sentence in list(self._kb_index.values()):
+            if id(sentence) not in listed:
+                self._forget(sentence)
+
+        knowledge = []
+        for sentence in self.knowledge:
+            if self._kb_index.get(sentence.mask) is not sentence:
+                self._adopt(sentence)
+                if not sentence.cells or sentence.mask in self._kb_index:
+                    continue
+                self._index(sentence)
+            knowledge.append(sentence)
+        self.knowledge[:] = knowledge
+
     def add_knowledge(self, cell, count):
         """
         Called when the Minesweeper board tells us, for a given
@@ -195,75 +407,139 @@ class MinesweeperAI():
                if they can be inferred from existing knowledge
         """
         # raise NotImplementedError
+        # Take in any changes made to self.knowledge directly
+        self._sync_knowledge()
+
         # Mark the cell as a move that has been made
-        self.moves_made.add(cell)
+        if cell not in self.moves_made:
+            self.moves_made.add(cell)
+            self._moves_seen += 1
+        self._available_safes.discard(cell)
 
         # Mark the cell as a safe move
-        self.mark_safe(cell)
-
-        # Find the closet cell to the current cell
-        closest = set()
-        for i in range(cell[0] - 1, cell[0] + 2):
-            for j in range(cell[1] - 1, cell[1] + 2):
-                if (i, j) != cell and 0 <= i < self.height and 0 <= j < self.width:
-                    if (i, j) not in self.safes and (i, j) not in self.mines:
-                        closest.add((i, j))
-                    elif (i, j) in self.mines:
-                        count -= 1
-
-        # Add new sentance into KB
-        new_sentence = Sentence(closest, count)
-        print(f'Move on cell: {cell} has added sentence to knowledge {closest} = {count}')
-        self.knowledge.append(new_sentence)
-
-        # Mark cells as safe or mines
-        self.infer_safes_and_mines()
-
-        # Infer new sentences from existing KB
-        new_KB = []
-        for sentence_1 in self.knowledge:
-            for sentence_2 in self.knowledge:
-                if sentence_1 != sentence_2 and sentence_1.cells.issubset(sentence_2.cells):
-                    new = Sentence(
-                        sentence_2.cells - sentence_1.cells,
-                        sentence_2.count - sentence_1.count
-                    )
-                    if new not in self.knowledge and new not in new_KB:
-                        new_KB.append(new)
-                        print(f'Added new sentence: {new}')
-
-                    # Overlap inference: detect if common cells must be mines
-                    overlap = sentence_1.cells.intersection(sentence_2.cells)
-                    if overlap:
-                        if sentence_1.count == 0:
-                            for cell in overlap:
-                                self.mark_safe(cell)
-                                print(f"Inferred safe from overlap: {cell}")
-                        elif sentence_1.count == sentence_2.count == len(overlap):
-                            for cell in overlap:
-                                self.mark_mine(cell)
-                                print(f"Inferred mine from overlap: {cell}")
-
-        self.knowledge.extend(new_KB)
-        self.infer_safes_and_mines()
+        self._mark_safe(cell)
+
+        # Find the cells surrounding the current cell
+        neighbors = set()
+        for di, dj in _NEIGHBORS:
+            i = cell[0] + di
+            j = cell[1] + dj
+            if 0 <= i < self.height and 0 <= j < self.width:
+                neighbors.add((i, j))
+
+        # Known mines account for part of the count, and only cells
+        # not yet known to be safe or mines go into the sentence
+        nearby_mines = neighbors & self.mines
+        closest = neighbors - self.safes - nearby_mines
+        count -= len(nearby_mines)
+
+        # A sentence with no mines or only mines determines all its cells
+        # outright, so mark them instead of adding it to the KB
+        if count == 0:
+            for neighbor in closest:
+                self._mark_safe(neighbor)
+        elif count == len(closest):
+            for neighbor in closest:
+                self._mark_mine(neighbor)
+        else:
+            # Add new sentance into KB
+            new_sentence = Sentence(closest, count, self.width)
+            logger.debug(
+                "Move on cell: %s has added sentence to knowledge %s = %s", cell, closest, count
+            )
+            self._add_sentence(new_sentence)
+
+        # Mark cells and infer new sentences until nothing changes
+        self._propagate()
 
     def infer_safes_and_mines(self):
         """
-        Updates AI knowledge to mark known safes and mines from sentences.
+        Updates AI knowledge to mark known safes and mines, and to add
+        sentences inferred with the subset method, until nothing changes.
         """
-        safes = set()
-        mines = set()
-        for sentence in self.knowledge:
-            safes = safes.union(sentence.known_safes())
-            mines = mines.union(sentence.known_mines())
+        self._sync_knowledge()
+        self._propagate()
 
-            for safe in safes:
-                self.mark_safe(safe)
-            for mine in mines:
-                self.mark_mine(mine)
+    def _propagate(self):
+        """
+        Propagates queued sentences until a fixpoint is reached.
+        Sentences whose cells are all safe or all mines are marked first;
+        only when none are left is a dirty sentence compared, using the
+        subset method, with other sentences that share a cell with it.
+        """
+        while self._units or self._dirty:
+            if self._units:
+                sentence = self._units.popleft()
+                if self._kb_index.get(sentence.mask) is not sentence:
+                    continue
 
-        print(f'Safe: {self.safes}')
-        print(f'Mines: {self.mines}')
+                # Each mark queues the sentences holding that cell.
+                # Marking empties the sentence, so iterate over a copy.
+                if safes := sentence.known_safes():
+                    for safe in list(safes):
+                        self._mark_safe(safe)
+                else:
+                    for mine in list(sentence.known_mines()):
+                        self._mark_mine(mine)
+                continue
+
+            _, sentence = self._dirty.popitem()
+
+            # Only sentences sharing a cell can be subsets or supersets.
+            # Dirty ones are skipped: each pair is compared once, when the
+            # second of the two is examined.
+            others = {}
+            for cell in sentence.cells:
+                for other in self._cell_to_sentences[cell]:
+                    if (other is not sentence
+                            and self._kb_index.get(other.mask) is other
+                            and other.mask not in self._dirty):
+                        others[other.mask] = other
+
+            for other in others.values():
+                overlap = sentence.mask & other.mask
+                if overlap == sentence.mask:
+                    subset, superset = sentence, other
+                elif overlap == other.mask:
+                    subset, superset = other, sentence
+                else:
+                    continue
+
+                # The KB holds at most one live sentence per cell mask, so a
+                # difference that is already known needs no new Sentence
+                if (superset.mask & ~subset.mask) in self._kb_index:
+                    continue
+
+                new = Sentence(
+                    superset.cells - subset.cells,
+                    superset.count - subset.count,
+                    self.width
+                )
+                if self._add_sentence(new):
+                    logger.debug("Added new sentence: %s", new)
+
+        # Drop sentences retired along the way
+        if len(self.knowledge) > len(self._kb_index):
+            self._sync_knowledge()
+
+        logger.debug("Safe: %s", self.safes)
+        logger.debug("Mines: %s", self.mines)
+
+    def dangerous_cells(self):
+        """
+        Returns the cells that appear in a sentence
+        still claiming at least one mine.
+        """
+        # The counts cover exactly the indexed sentences, so they answer
+        # whenever self.knowledge holds those and nothing else
+        if len(self.knowledge) == len(self._kb_index) and all(
+            self._kb_index.get(sentence.mask) is sentence
+            for sentence in self.knowledge
+        ):
+            return self._dangerous.keys()
+        return set().union(
+            *(sentence.cells for sentence in self.knowledge if sentence.count > 0)
+        )
 
     def make_safe_move(self):
         """
@@ -275,15 +551,17 @@ class MinesweeperAI():
         and self.moves_made, but should not modify any of those values.
         """
         # raise NotImplementedError
-        possible_moves = list(self.safes - self.moves_made)
-
-        valid_moves = [
-            cell for cell in possible_moves
-            if all(cell not in sentence.cells or sentence.count == 0 for sentence in self.knowledge)
-        ]
+        # self.safes and self.moves_made may have been changed directly
+        if (len(self.safes) != self._safes_seen
+                or len(self.moves_made) != self._moves_seen):
+            self._available_safes = self.safes - self.moves_made
+            self._safes_seen = len(self.safes)
+            self._moves_seen = len(self.moves_made)
+
+        valid_moves = list(self._available_safes - self.dangerous_cells())
         if valid_moves:
             cell = random.choice(valid_moves)
-            print(f'Move on cell: {cell}')
+            logger.debug("Move on cell: %s", cell)
             return cell
         return None
 
@@ -298,16 +576,12 @@ class MinesweeperAI():
         if len(self.mines) + len(self.moves_made) == self.height * self.width:
             return None
 
-        all_cells = set((i, j) for i in range(self.height) for j in range(self.width))
-        possible_moves = list(all_cells - self.moves_made - self.mines)
-
-        valid_moves = [
-            cell for cell in possible_moves
-            if all(cell not in sentence.cells or sentence.count == 0 for sentence in self.knowledge)
-        ]
+        valid_moves = (
+            self._all_cells - self.moves_made - self.mines - self.dangerous_cells()
+        )
 
         if valid_moves:
-            cell = random.choice(valid_moves)
-            print(f'Move on cell: {cell}')
+            cell = random.choice(tuple(valid_moves))
+            logger.debug("Move on cell: %s", cell)
             return cell
         return None